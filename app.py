@@ -1,13 +1,19 @@
 import os
-import base64
-from datetime import datetime
+import re
+from datetime import datetime, timezone
 from io import BytesIO
 from typing import List
 
+import orjson
+import pybase64
 import requests
 import streamlit as st
+import zstandard
 from dotenv import load_dotenv
-from pydantic import BaseModel, EmailStr, Field, ValidationError
+from PIL import Image, ImageOps
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.util.retry import Retry
 
 # Load environment variables
 load_dotenv()
@@ -25,26 +31,206 @@ if not WEBHOOK_URL:
     st.error("⚠️ WEBHOOK_URL environment variable is not set. Please check your .env file.")
     st.stop()
 
-# Validation models
-class Attachment(BaseModel):
-    filename: str = Field(min_length=1, max_length=255)
-    content_type: str | None = None
-    size_bytes: int = Field(le=5 * 1024 * 1024)  # 5 MB limit
-    content_base64: str
+# Send attachments as binary multipart parts instead of base64 inside JSON.
+# Off by default because the webhook workflow must be set up to read them.
+MULTIPART_UPLOADS = os.getenv("MULTIPART_UPLOADS", "0") == "1"
 
+# zstd-compress the JSON body. Also off by default; the webhook must accept
+# Content-Encoding: zstd. Has no effect on multipart uploads.
+COMPRESS_PAYLOAD = os.getenv("COMPRESS_PAYLOAD", "0") == "1"
 
-class ComplaintSubmission(BaseModel):
-    name: str = Field(min_length=2, max_length=100)
-    email: EmailStr
-    subject: str = Field(min_length=3, max_length=200)
-    complaint: str = Field(min_length=10, max_length=2000)
-    priority: str = Field(pattern="^(Low|Medium|High|Urgent)$")
-    timestamp: str
-    attachments: List[Attachment] = Field(default_factory=list, min_length=1)
+# Whether at least one supporting document must be attached
+REQUIRE_ATTACHMENTS = os.getenv("REQUIRE_ATTACHMENTS", "1") == "1"
 
+# Per-file attachment size limit
+MAX_FILE_MB = int(os.getenv("MAX_FILE_MB", "5"))
+MAX_FILE_SIZE = MAX_FILE_MB * 1024 * 1024
 
-# Header with info button
-st.markdown("""
+# Photos of receipts are downscaled and re-encoded before upload
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic"}
+IMAGE_MAX_SIDE = 2048
+IMAGE_JPEG_QUALITY = 80
+# Larger images are sent as-is rather than decoded (a small PNG can still
+# expand to gigabytes of pixels; Pillow only errors above ~179 MP)
+IMAGE_MAX_PIXELS = 40_000_000
+# Images may be this much over the cap before shrinking; anything larger is
+# rejected without being decoded
+MAX_RAW_IMAGE_SIZE = 4 * MAX_FILE_SIZE
+
+
+@st.cache_resource
+def _session() -> requests.Session:
+    """One keep-alive session per server process, shared across reruns."""
+    session = requests.Session()
+    # POST is not in Retry's default allowed_methods, so only failed
+    # connections are retried and a complaint is never sent twice
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=2, backoff_factor=0.3),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Lightweight email check; the webhook remains the real arbiter of validity
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+@st.cache_resource
+def _models():
+    """Build the validation models once per server process.
+
+    Streamlit re-executes this script on every rerun, so module-level model
+    classes would rebuild their pydantic-core schema each time. pydantic is
+    imported here so the page renders before it is loaded; only submits need it.
+    """
+    from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+    # Attachments are only built with model_construct, after the explicit
+    # MAX_FILE_SIZE and REQUIRE_ATTACHMENTS checks in the submit handler, so
+    # those limits are not repeated as (unenforced) field constraints here
+    class Attachment(BaseModel):
+        filename: str = Field(min_length=1, max_length=255)
+        content_type: str | None = None
+        size_bytes: int
+        content_base64: str
+
+    class ComplaintDetails(BaseModel):
+        model_config = ConfigDict(str_strip_whitespace=True)
+
+        name: str = Field(min_length=2, max_length=100)
+        email: str
+        subject: str = Field(min_length=3, max_length=200)
+        complaint: str = Field(min_length=10, max_length=2000)
+        priority: str = Field(pattern="^(Low|Medium|High|Urgent)$")
+        timestamp: str
+
+        @field_validator("email")
+        @classmethod
+        def check_email(cls, v: str) -> str:
+            if not _EMAIL_RE.fullmatch(v):
+                raise ValueError("value is not a valid email address")
+            return v
+
+    class ComplaintSubmission(ComplaintDetails):
+        attachments: List[Attachment] = Field(default_factory=list)
+
+    return Attachment, ComplaintDetails, ComplaintSubmission, ValidationError
+
+
+def encode_attachment(file) -> dict:
+    """Base64-encode an upload straight from its in-memory buffer."""
+    # getbuffer() is a zero-copy view, so only the encoded str is allocated
+    with file.getbuffer() as view:
+        return {
+            "filename": file.name,
+            "content_type": file.type,
+            "size_bytes": view.nbytes,
+            "content_base64": pybase64.b64encode_as_string(view),
+        }
+
+
+def _flatten_alpha(img):
+    """Composite transparent images onto white so JPEG doesn't turn them black."""
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def shrink_image(file):
+    """Re-encode an image upload as a smaller JPEG.
+
+    Returns a BytesIO carrying the same name/type/size attributes as an
+    UploadedFile, or the original file if it is not an image we can read or
+    re-encoding would not make it smaller.
+    """
+    if file.type not in IMAGE_TYPES:
+        return file
+    file.seek(0)
+    try:
+        with Image.open(file) as img:
+            img.draft("RGB", (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))  # cheap JPEG downscale on decode
+            if img.width * img.height > IMAGE_MAX_PIXELS:
+                return file
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+            out = BytesIO()
+            _flatten_alpha(img).save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Unreadable or unsupported (e.g. HEIC without a plugin): send as-is
+        return file
+    if out.tell() >= file.size:
+        return file
+    out.name = os.path.splitext(file.name)[0] + ".jpg"
+    out.type = "image/jpeg"
+    out.size = out.tell()
+    out.seek(0)
+    return out
+
+
+class _StreamingPart:
+    """Read-only view of an upload for MultipartEncoder.
+
+    The encoder copies anything with getvalue() or fileno() into its own
+    buffer, so only read() and the remaining length are exposed.
+    """
+
+    def __init__(self, file):
+        file.seek(0)
+        self._file = file
+        self._size = file.size
+
+    @property
+    def len(self) -> int:
+        return self._size - self._file.tell()
+
+    def read(self, length: int = -1) -> bytes:
+        return self._file.read(length)
+
+
+def _check_size(file, max_file_size: int, file_errors: list) -> bool:
+    """Record an error for an oversized upload and report whether it fits."""
+    if file.size > max_file_size:
+        file_errors.append(f"❌ {file.name} exceeds {max_file_size // (1024 * 1024)} MB limit.")
+        return False
+    return True
+
+
+# Ensure default values live in session state so they persist after errors
+DEFAULT_FORM_STATE = {
+    "name_input": "",
+    "email_input": "",
+    "subject_input": "",
+    "complaint_input": "",
+    "priority_input": "Low",
+}
+
+
+# Explainer shown by the "How it works" button
+MARKDOWN_HOWTO = """
+**How our Complaint Box operates:**
+
+1. **Submit Your Complaint**: Drop any complaint that you have about your device
+2. **Attach Invoice**: Attach the invoice or other supporting documents
+3. **AI Agent Processing**: Our AI agent will:
+   - Extract all the needful information from your complaint and documents
+   - Draft a professional complaint to the customer care email ID
+   - *(Future features)*: Make calls and tweet on your behalf
+
+**Beta Version:**
+- In this beta version, we send an email to you with the customer care email ID and the drafted complaint
+
+Simply fill out the form below and let us handle the rest! 🚀
+"""
+
+
+# Header layout styles
+HEADER_CSS = """
 <style>
     .header-container {
         display: flex;
@@ -52,7 +238,11 @@ st.markdown("""
         justify-content: space-between;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+# Header with info button
+st.markdown(HEADER_CSS, unsafe_allow_html=True)
 
 col1, col2 = st.columns([3, 1])
 with col1:
@@ -67,43 +257,22 @@ with col2:
 # Show explanation if button was clicked
 if st.session_state.get('show_info', False):
     with st.expander("📖 How Complaint Box Works", expanded=True):
-        st.markdown("""
-        **How our Complaint Box operates:**
-        
-        1. **Submit Your Complaint**: Drop any complaint that you have about your device
-        2. **Attach Invoice**: Attach the invoice or other supporting documents
-        3. **AI Agent Processing**: Our AI agent will:
-           - Extract all the needful information from your complaint and documents
-           - Draft a professional complaint to the customer care email ID
-           - *(Future features)*: Make calls and tweet on your behalf
-        
-        **Beta Version:**
-        - In this beta version, we send an email to you with the customer care email ID and the drafted complaint
-        
-        Simply fill out the form below and let us handle the rest! 🚀
-        """)
+        st.markdown(MARKDOWN_HOWTO)
 
 st.markdown("Please fill out the form below to submit your complaint.")
 
-# Ensure default values live in session state so they persist after errors
-default_form_state = {
-    "name_input": "",
-    "email_input": "",
-    "subject_input": "",
-    "complaint_input": "",
-    "priority_input": "Low",
-}
-
-# Initialize defaults once
-for key, default in default_form_state.items():
-    st.session_state.setdefault(key, default)
-st.session_state.setdefault("uploader_key", 0)
-st.session_state.setdefault("success_note", "")
-st.session_state.setdefault("reset_form", False)
+# Initialize defaults once per session
+if not st.session_state.get("_page_inited"):
+    for key, default in DEFAULT_FORM_STATE.items():
+        st.session_state.setdefault(key, default)
+    st.session_state.setdefault("uploader_key", 0)
+    st.session_state.setdefault("success_note", "")
+    st.session_state.setdefault("reset_form", False)
+    st.session_state._page_inited = True
 
 # Apply pending reset BEFORE widgets instantiate
 if st.session_state.get("reset_form"):
-    for key, default in default_form_state.items():
+    for key, default in DEFAULT_FORM_STATE.items():
         st.session_state[key] = default
     st.session_state.uploader_key += 1  # force uploader to reset
     st.session_state.reset_form = False
@@ -125,19 +294,30 @@ with st.form("complaint_form", clear_on_submit=False):
     
     # File uploader
     uploaded_files = st.file_uploader(
-        "Attach invoices or other supporting documents (Required)",
+        f"Attach invoices or other supporting documents ({'Required' if REQUIRE_ATTACHMENTS else 'Optional'})",
         type=None,  # Accept all file types
         accept_multiple_files=True,
-        help="Required: at least one supporting document so we can process your complaint.",
+        help=(
+            "Required: at least one supporting document so we can process your complaint."
+            if REQUIRE_ATTACHMENTS
+            else "Optional: supporting documents help us process your complaint."
+        ),
         key=f"uploaded_files_{st.session_state.uploader_key}",
     )
     
     # Display uploaded files info
     if uploaded_files:
+        # Rebuild the captions only when the selection changes, not on every rerun
+        preview_key = tuple((file.file_id, file.size) for file in uploaded_files)
+        if st.session_state.get("_preview_key") != preview_key:
+            st.session_state._preview_key = preview_key
+            st.session_state._preview_lines = [
+                f"{idx}. {file.name} ({file.size / 1024:.2f} KB)"  # Size in KB
+                for idx, file in enumerate(uploaded_files, 1)
+            ]
         st.info(f"📎 {len(uploaded_files)} file(s) selected")
-        for idx, file in enumerate(uploaded_files, 1):
-            file_size = len(file.getvalue()) / 1024  # Size in KB
-            st.caption(f"{idx}. {file.name} ({file_size:.2f} KB)")
+        for line in st.session_state._preview_lines:
+            st.caption(line)
     
     # Submit button
     submitted = st.form_submit_button("Submit Complaint", type="primary")
@@ -146,52 +326,88 @@ with st.form("complaint_form", clear_on_submit=False):
         # Early required-field check
         if not name or not email or not subject or not complaint:
             st.error("⚠️ Please fill in all required fields (marked with *)")
-        elif not uploaded_files:
+        elif REQUIRE_ATTACHMENTS and not uploaded_files:
             st.error("⚠️ Please attach at least one supporting document (required).")
         else:
             # Prepare base form data
+            # Whitespace is stripped by the model (str_strip_whitespace)
             form_data = {
-                "name": name.strip(),
-                "email": email.strip(),
-                "subject": subject.strip(),
-                "complaint": complaint.strip(),
+                "name": name,
+                "email": email,
+                "subject": subject,
+                "complaint": complaint,
                 "priority": priority,
-                "timestamp": datetime.now().isoformat(),
-                "attachments": []
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
             }
 
-            # Process uploaded files with size guard (5 MB per file)
-            file_errors = []
-            max_file_size = 5 * 1024 * 1024  # 5 MB
-            if uploaded_files:
-                for file in uploaded_files:
-                    file_content = file.getvalue()
-                    if len(file_content) > max_file_size:
-                        file_errors.append(f"❌ {file.name} exceeds 5 MB limit.")
-                        continue
-                    file_data = {
-                        "filename": file.name,
-                        "content_type": file.type,
-                        "size_bytes": len(file_content),
-                        "content_base64": base64.b64encode(file_content).decode("utf-8"),
-                    }
-                    form_data["attachments"].append(file_data)
-
-            if file_errors:
-                st.error("\n".join(file_errors))
-            elif len(form_data["attachments"]) == 0:
-                st.error("⚠️ Please attach at least one supporting document (required).")
-            else:
-                try:
-                    # Validate payload with Pydantic
-                    validated = ComplaintSubmission(**form_data)
+            Attachment, ComplaintDetails, ComplaintSubmission, ValidationError = _models()
+            try:
+                # Validate the user-entered fields first so a typo doesn't cost
+                # re-encoding every attached image
+                details = ComplaintDetails(**form_data)
+
+                # Process uploaded files with a per-file size guard. Raw sizes are
+                # checked before anything is read; images get headroom so a phone
+                # photo just over the cap can be shrunk, then the result is checked.
+                file_errors = []
+                attachments = [
+                    shrink_image(file) for file in uploaded_files or []
+                    if _check_size(
+                        file,
+                        MAX_RAW_IMAGE_SIZE if file.type in IMAGE_TYPES else MAX_FILE_SIZE,
+                        file_errors,
+                    )
+                ]
+                attachments = [
+                    file for file in attachments
+                    if _check_size(file, MAX_FILE_SIZE, file_errors)
+                ]
+
+                if file_errors:
+                    st.error("\n".join(file_errors))
+                elif REQUIRE_ATTACHMENTS and len(attachments) == 0:
+                    st.error("⚠️ Please attach at least one supporting document (required).")
+                else:
+                    if MULTIPART_UPLOADS:
+                        # requests' own files= encoder builds the whole body in memory;
+                        # MultipartEncoder reads each file as the socket consumes it
+                        fields = list(details.model_dump().items())
+                        for file in attachments:
+                            fields.append((
+                                "attachments",
+                                (
+                                    file.name,
+                                    _StreamingPart(file),
+                                    file.type or "application/octet-stream",
+                                ),
+                            ))
+                        encoder = MultipartEncoder(fields=fields)
+                        request_kwargs = {
+                            "data": encoder,
+                            "headers": {"Content-Type": encoder.content_type},
+                        }
+                    else:
+                        encoded = [encode_attachment(file) for file in attachments]
+                        # Attachments are size-checked above and named by Streamlit, so
+                        # they are constructed without re-walking the base64 content
+                        validated = ComplaintSubmission.model_construct(
+                            attachments=[Attachment.model_construct(**a) for a in encoded],
+                            **details.model_dump(),
+                        )
+                        # Serialize once with orjson; it emits bytes ready for the socket
+                        body = orjson.dumps(validated.model_dump())
+                        headers = {"Content-Type": "application/json"}
+                        if COMPRESS_PAYLOAD:
+                            body = zstandard.ZstdCompressor(level=3).compress(body)
+                            headers["Content-Encoding"] = "zstd"
+                        request_kwargs = {"data": body, "headers": headers}
 
                     # Show loading spinner
                     with st.spinner("Submitting your complaint..."):
-                        response = requests.post(
+                        response = _session().post(
                             WEBHOOK_URL,
-                            json=validated.model_dump(),
-                            timeout=30  # Increased timeout for file uploads
+                            timeout=30,  # Increased timeout for file uploads
+                            **request_kwargs,
                         )
 
                     # Check response
@@ -206,19 +422,19 @@ with st.form("complaint_form", clear_on_submit=False):
                         st.warning(f"⚠️ Submission received with status code: {response.status_code}")
                         st.info(f"Response: {response.text}")
 
-                except ValidationError as ve:
-                    # Display validation errors in a user-friendly list
-                    errors = []
-                    for err in ve.errors():
-                        loc = " -> ".join(str(part) for part in err["loc"])
-                        errors.append(f"{loc}: {err['msg']}")
-                    st.error("Validation issues:\n" + "\n".join(errors))
-                except requests.exceptions.Timeout:
-                    st.error("⏱️ Request timed out. Please try again.")
-                except requests.exceptions.RequestException as e:
-                    st.error(f"❌ An error occurred while submitting: {str(e)}")
-                except Exception as e:
-                    st.error(f"❌ Unexpected error: {str(e)}")
+            except ValidationError as ve:
+                # Display validation errors in a user-friendly list
+                errors = []
+                for err in ve.errors():
+                    loc = " -> ".join(str(part) for part in err["loc"])
+                    errors.append(f"{loc}: {err['msg']}")
+                st.error("Validation issues:\n" + "\n".join(errors))
+            except requests.exceptions.Timeout:
+                st.error("⏱️ Request timed out. Please try again.")
+            except requests.exceptions.RequestException as e:
+                st.error(f"❌ An error occurred while submitting: {str(e)}")
+            except Exception as e:
+                st.error(f"❌ Unexpected error: {str(e)}")
 
 # Footer
 st.markdown("---")